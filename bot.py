@@ -1,10 +1,20 @@
 import os
+import re
+import sys
+import time
 import logging
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-from collections import defaultdict
+import random
+import sqlite3
+import threading
+from typing import Any, Awaitable, Callable, List, Dict, Optional, NamedTuple, Tuple, Union
+from functools import lru_cache
 import aiohttp
 import asyncio
+import msgspec
+import orjson
+from aiolimiter import AsyncLimiter
+from yarl import URL
+from cachetools import LRUCache, TTLCache
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler
 
@@ -16,201 +26,829 @@ TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
 ETHERSCAN_API_KEY = os.environ.get('ETHERSCAN_API_KEY', '')
 HELIUS_API_KEY = os.environ.get('HELIUS_API_KEY', '')
 COINGECKO_API_KEY = os.environ.get('COINGECKO_API_KEY', '')
+COINGECKO_PLAN = os.environ.get('COINGECKO_PLAN', 'demo').lower()  # 'demo' (free) or 'pro'; picks host and key header
 
 # Log what we loaded (without showing full keys)
 logger.info(f"Loaded TELEGRAM_BOT_TOKEN: {'✓' if TELEGRAM_BOT_TOKEN else '✗'}")
 logger.info(f"Loaded ETHERSCAN_API_KEY: {'✓' if ETHERSCAN_API_KEY else '✗'}")
 logger.info(f"Loaded HELIUS_API_KEY: {'✓' if HELIUS_API_KEY else '✗'} (length: {len(HELIUS_API_KEY)})")
-logger.info(f"Loaded COINGECKO_API_KEY: {'✓' if COINGECKO_API_KEY else '✗'}")
+logger.info(f"Loaded COINGECKO_API_KEY: {'✓ (' + COINGECKO_PLAN + ' plan)' if COINGECKO_API_KEY else '✗'}")
+
+# Concurrency limits
+REQUEST_TIMEOUT = 15  # seconds per outbound HTTP call
+CONNECT_TIMEOUT = 5  # seconds to get a pooled or new connection; fail fast so retries kick in
+WALLET_TIMEOUT = 60  # seconds per wallet analysis
+PREFETCH_TIMEOUT = 20  # seconds for the shared balance/price prefetch before wallets fetch their own
+MAX_CONCURRENT_WALLETS = 5  # keeps Etherscan/Helius bursts within their per-second limits
+HTTP_POOL_SIZE = 200
+HTTP_POOL_SIZE_PER_HOST = 32
+DNS_CACHE_TTL = 600  # seconds
+KEEPALIVE_TIMEOUT = 75  # seconds an idle pooled connection stays open
+METADATA_CONCURRENCY = 8  # parallel Jupiter token lookups, kept under its rate limit
+RPC_BATCH_SIZE = 10  # max JSON-RPC calls packed into one HTTP request
+ETHERSCAN_BALANCE_BATCH_SIZE = 20  # max addresses per Etherscan balancemulti call
+DAS_BATCH_SIZE = 1000  # max asset ids per Helius getAssetBatch call
+PRICE_TTL = 30  # seconds a live CoinGecko price is reused
+LIVE_PRICE_CACHE_SIZE = 4096
+PRICE_COIN_IDS = ('solana', 'ethereum')  # live prices fetched together in one call
+MAX_RETRIES = 4  # retries after the first attempt
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+RETRY_INITIAL_DELAY = 0.25  # seconds
+RETRY_MAX_DELAY = 8  # seconds
+PRICE_MAX_RETRIES = 1  # prices fall back to 0, so don't hold up an analysis retrying them
+PRICE_FAILURE_TTL = 15  # seconds a failed price lookup is remembered so lock waiters don't refetch
+
+# Upstream rate limits (free tiers by default; raise these when upgrading a plan)
+HELIUS_RPC_RPS = float(os.environ.get('HELIUS_RPC_RPS', 10))
+HELIUS_DAS_RPS = float(os.environ.get('HELIUS_DAS_RPS', 2))
+COINGECKO_RPM = float(os.environ.get('COINGECKO_RPM', 30))
+ETHERSCAN_RPS = float(os.environ.get('ETHERSCAN_RPS', 5))
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+# Built once; the key goes in a header rather than the query string, and Pro keys
+# are only accepted on the Pro host with their own header name
+COINGECKO_KEY_HEADER = 'x-cg-pro-api-key' if COINGECKO_PLAN == 'pro' else 'x-cg-demo-api-key'
+COINGECKO_HEADERS = {COINGECKO_KEY_HEADER: COINGECKO_API_KEY} if COINGECKO_API_KEY else {}
+TELEGRAM_MESSAGE_LIMIT = 4096  # UTF-16 code units per message
+WALLET_SEPARATOR = '=' * 35 + '\n'  # rule between wallets in a report
+TELEGRAM_POOL_SIZE = 512  # connections to the Bot API for outgoing replies and edits
+TELEGRAM_POOL_TIMEOUT = 30  # seconds to wait for a free Bot API connection
+TELEGRAM_UPDATES_POOL_SIZE = 32  # connections for getUpdates polling
+
+# Parsed once; aiohttp sends yarl URLs without re-parsing them
+ETHERSCAN_API_URL = URL('https://api.etherscan.io/v2/api').with_query(chainid=1)
+COINGECKO_API_URL = URL('https://pro-api.coingecko.com/api/v3' if COINGECKO_PLAN == 'pro' and COINGECKO_API_KEY
+                        else 'https://api.coingecko.com/api/v3')
+HELIUS_API_URL = URL('https://api.helius.xyz/v0')
+JUPITER_TOKEN_URL = URL('https://tokens.jup.ag/token')
+
+StrOrURL = Union[str, URL]
+ETH_ADDRESS_RE = re.compile(r'0x[0-9a-fA-F]{40}')
+SOL_ADDRESS_RE = re.compile(r'[1-9A-HJ-NP-Za-km-z]{32,44}')  # base58 alphabet
+PARSED_TX_CACHE_SIZE = 50_000  # finalized transactions are immutable, so entries never go stale
+HELIUS_PAGE_LIMIT = 100  # max transactions per enhanced-transactions request
+WALLET_HISTORY_LIMIT = 1000  # parsed transactions kept per wallet
+RAW_CACHE_MAX_ROWS = int(os.environ.get('RAW_CACHE_MAX_ROWS', 100_000))  # rows of fetched chain data kept in memory, roughly 1 KB each
+RAW_DATA_TTL = int(os.environ.get('CACHE_TTL_SECONDS', 300))  # seconds; period buttons and repeat /analyze calls reuse this data
+ETHERSCAN_PAGE_SIZE = 2000  # rows per txlist/tokentx page
+ETHERSCAN_MAX_ROWS = 10000  # Etherscan rejects page * offset beyond this
+SIGNATURE_LIMIT = 1000  # signatures requested by the plain-RPC activity fallback
+HISTORY_SCHEMA_VERSION = 2  # bump whenever the ParsedTx layout changes
+TOKEN_SYMBOL_TTL = 30 * 86400  # seconds a resolved token symbol is trusted
+TOKEN_SYMBOL_MISS_TTL = 3600  # seconds before an unknown mint is looked up again
+WALLET_DB_PATH = os.environ.get('WALLET_DB_PATH', 'wallet_cache.db')
+
+class ParsedTx(NamedTuple):
+    """The parts of a Helius enhanced transaction used for P&L"""
+    timestamp: int
+    type: str
+    token_transfers: Tuple[Tuple[str, float, str, str, Optional[str]], ...]  # (mint, amount, from, to, symbol)
+    native_transfers: Tuple[Tuple[int, str, str], ...]  # (lamports, from, to)
+
+class EthTx(msgspec.Struct, gc=False):
+    """Schema for the Etherscan txlist fields used for P&L; input data and the rest of each row are skipped while decoding"""
+    timestamp: int = msgspec.field(name='timeStamp')
+    value: int = 0  # wei
+    from_addr: str = msgspec.field(name='from', default='')
+    to_addr: str = msgspec.field(name='to', default='')
+
+class EtherscanTokenTransfer(msgspec.Struct, gc=False):
+    """Schema for the Etherscan tokentx fields used for P&L"""
+    timestamp: int = msgspec.field(name='timeStamp')
+    value: int = 0
+    from_addr: str = msgspec.field(name='from', default='')
+    to_addr: str = msgspec.field(name='to', default='')
+    contract: str = msgspec.field(name='contractAddress', default='')
+    symbol: str = msgspec.field(name='tokenSymbol', default='UNKNOWN')
+    decimals: str = msgspec.field(name='tokenDecimal', default='18')  # '' for some tokens
+
+class EtherscanTxList(msgspec.Struct):
+    status: str = '0'
+    result: Union[List[EthTx], str] = []  # an error message when status is '0'
+
+class EtherscanTokenTxList(msgspec.Struct):
+    status: str = '0'
+    result: Union[List[EtherscanTokenTransfer], str] = []
+
+class EthTokenTx(NamedTuple):
+    """A token transfer as cached for P&L"""
+    timestamp: int
+    amount: float  # already scaled by the token's decimals
+    from_addr: str
+    to_addr: str
+    contract: str
+    symbol: str
+
+class EthereumRaw(NamedTuple):
+    """A wallet's Etherscan data, newest first, as cached between period switches"""
+    transactions: List[EthTx]
+    token_txs: List[EthTokenTx]
+    balance_wei: int
+    covered_from: int  # rows newer than this are complete; 0 when the lists reach as far back as Etherscan goes
+
+# Etherscan sends every number as a string; non-strict decoding turns them into ints in C
+ETHERSCAN_TXLIST_DECODER = msgspec.json.Decoder(EtherscanTxList, strict=False)
+ETHERSCAN_TOKENTX_DECODER = msgspec.json.Decoder(EtherscanTokenTxList, strict=False)
+
+class HeliusTokenTransfer(msgspec.Struct):
+    mint: str = ''
+    tokenAmount: float = 0.0
+    fromUserAccount: Optional[str] = ''
+    toUserAccount: Optional[str] = ''
+    tokenSymbol: Optional[str] = None
+    symbol: Optional[str] = None
+
+class HeliusNativeTransfer(msgspec.Struct):
+    amount: int = 0
+    fromUserAccount: Optional[str] = ''
+    toUserAccount: Optional[str] = ''
+
+class HeliusTx(msgspec.Struct):
+    """Schema for the enhanced-transactions fields we read; the rest of each payload is skipped while decoding"""
+    signature: str = ''
+    timestamp: int = 0
+    type: Optional[str] = ''
+    tokenTransfers: List[HeliusTokenTransfer] = []
+    nativeTransfers: List[HeliusNativeTransfer] = []
+
+HELIUS_TXS_DECODER = msgspec.json.Decoder(List[HeliusTx])
+
+def intern_key(value: Optional[str]) -> Optional[str]:
+    """Intern mint/account strings so repeats share one object across cached and stored transactions"""
+    return sys.intern(value) if value else value
+
+def parse_enhanced_tx(tx: HeliusTx) -> ParsedTx:
+    token_transfers = tuple(
+        (
+            intern_key(transfer.mint),
+            transfer.tokenAmount,
+            intern_key(transfer.fromUserAccount),
+            intern_key(transfer.toUserAccount),
+            transfer.tokenSymbol or transfer.symbol
+        )
+        for transfer in tx.tokenTransfers
+    )
+    native_transfers = tuple(
+        (transfer.amount, intern_key(transfer.fromUserAccount), intern_key(transfer.toUserAccount))
+        for transfer in tx.nativeTransfers
+    )
+    return ParsedTx(tx.timestamp, tx.type, token_transfers, native_transfers)
+
+class SolanaPnlState:
+    """Running trade totals for one wallet, filled in by the TX_HANDLERS"""
+    __slots__ = ('address', 'transfers', 'symbols', 'lamports_in', 'lamports_out', 'swap_count')
+    
+    def __init__(self, address: str):
+        self.address = address
+        self.transfers = []  # (mint, signed token amount, timestamp) rows for aggregate_transfers
+        self.symbols = {}
+        self.lamports_in = 0
+        self.lamports_out = 0
+        self.swap_count = 0
+
+def handle_swap_tx(tx: ParsedTx, state: SolanaPnlState):
+    address = state.address
+    state.swap_count += 1
+    
+    for mint, amount, from_addr, to_addr, symbol in tx.token_transfers:
+        if from_addr == address:
+            state.transfers.append((mint, -amount, tx.timestamp))
+        elif to_addr == address:
+            state.transfers.append((mint, amount, tx.timestamp))
+        else:
+            continue
+        if symbol:
+            state.symbols[mint] = symbol
+    
+    # Track SOL movements in exact integer lamports
+    for lamports, from_addr, to_addr in tx.native_transfers:
+        if from_addr == address:
+            state.lamports_out += lamports
+        elif to_addr == address:
+            state.lamports_in += lamports
+
+def handle_ignored_tx(tx: ParsedTx, state: SolanaPnlState):
+    pass
+
+# Helius enhanced-transaction type -> P&L handler; only trades contribute today
+TX_HANDLERS = {
+    'SWAP': handle_swap_tx,
+    'TRADE': handle_swap_tx,
+}
+
+class UpstreamError(Exception):
+    """An upstream API call that failed for good.
+    
+    The message names only the status and host: request URLs carry API keys in
+    their query strings, and these messages end up in logs and Telegram replies.
+    """
+    def __init__(self, host: Optional[str], reason: str, status: Optional[int] = None):
+        super().__init__(f"{reason} from {host}")
+        self.status = status
+
+class RateLimitedReply(Exception):
+    """Raised by a response decoder when an upstream reports rate limiting inside a 2xx body"""
+
+def etherscan_rate_limited(data: Any) -> bool:
+    """Whether a decoded Etherscan reply is its rate-limit error (HTTP 200, status '0', a message result)"""
+    if isinstance(data, dict):
+        status, result = data.get('status'), data.get('result')
+    else:
+        status, result = data.status, data.result
+    return status != '1' and isinstance(result, str) and 'rate limit' in result.lower()
+
+def error_text(e: BaseException) -> str:
+    """Description of an exception that is safe to log or show; raw aiohttp errors can embed request URLs"""
+    if isinstance(e, aiohttp.ClientError):
+        return type(e).__name__
+    return str(e) or type(e).__name__
+
+def retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Seconds to wait before retrying after the given 0-based attempt.
+    
+    A Retry-After header in seconds wins (still capped at RETRY_MAX_DELAY);
+    otherwise capped exponential backoff plus jitter, so concurrent callers
+    don't retry in lockstep.
+    """
+    if retry_after is not None:
+        try:
+            return min(max(float(retry_after), 0.0), RETRY_MAX_DELAY)
+        except ValueError:
+            pass
+    return min(RETRY_INITIAL_DELAY * 2 ** attempt, RETRY_MAX_DELAY) + random.uniform(0, RETRY_INITIAL_DELAY)
+
+def scale_token_transfers(rows: List[EtherscanTokenTransfer]) -> List[EthTokenTx]:
+    """Scale each decoded tokentx value by its token's decimals once, so period switches reuse the amounts"""
+    return [
+        EthTokenTx(
+            row.timestamp,
+            row.value / 10 ** int(row.decimals or 18),
+            row.from_addr,
+            row.to_addr,
+            row.contract,
+            row.symbol,
+        )
+        for row in rows
+    ]
+
+def raw_rows(data: Any) -> int:
+    """Size of a raw_cache entry in rows, so the cache is bounded by data held rather than wallet count"""
+    if isinstance(data, EthereumRaw):
+        return max(1, len(data.transactions) + len(data.token_txs))
+    return max(1, len(data))
+
+def period_cutoff(period_days: Optional[int]) -> int:
+    """Unix timestamp where an analysis period starts; 0 for all time"""
+    return int(time.time()) - period_days * 86400 if period_days else 0
+
+def aggregate_transfers(transfers: List[Tuple[str, float, int]]) -> Dict[str, List]:
+    """Fold (mint, signed amount, timestamp) rows into per-mint [in, out, first_ts, last_ts].
+    
+    Accumulators are positional lists rather than dicts so the per-row updates
+    are index stores, not string-key hashes.
+    """
+    totals = {}
+    for mint, amount, ts in transfers:
+        agg = totals.get(mint)
+        if agg is None:
+            agg = totals[mint] = [0.0, 0.0, ts, ts]
+        if amount >= 0:
+            agg[0] += amount
+        else:
+            agg[1] -= amount
+        if ts < agg[2]:
+            agg[2] = ts
+        elif ts > agg[3]:
+            agg[3] = ts
+    return totals
+
+class WalletHistoryStore:
+    """SQLite-backed per-wallet cursor (newest seen signature plus the parsed history behind it)
+    and a persistent mint -> token symbol cache"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+    
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            # Stored rows mirror the ParsedTx layout, so drop them when it changes
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != HISTORY_SCHEMA_VERSION:
+                self._conn.execute("DROP TABLE IF EXISTS wallet_cursor")
+                self._conn.execute(f"PRAGMA user_version = {HISTORY_SCHEMA_VERSION}")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS wallet_cursor (addr TEXT PRIMARY KEY, last_sig TEXT, txs_json BLOB)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_symbol (mint TEXT PRIMARY KEY, symbol TEXT, expires_at INTEGER)"
+            )
+        return self._conn
+    
+    def load(self, address: str) -> Tuple[Optional[str], List[ParsedTx]]:
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT last_sig, txs_json FROM wallet_cursor WHERE addr = ?", (address,)
+                ).fetchone()
+            if not row:
+                return None, []
+            last_sig, txs_json = row
+            txs = [
+                ParsedTx(
+                    ts,
+                    tx_type,
+                    tuple((intern_key(mint), amount, intern_key(src), intern_key(dst), symbol)
+                          for mint, amount, src, dst, symbol in token_transfers),
+                    tuple((lamports, intern_key(src), intern_key(dst)) for lamports, src, dst in native_transfers)
+                )
+                for ts, tx_type, token_transfers, native_transfers in orjson.loads(txs_json)
+            ]
+            return last_sig, txs
+        except Exception as e:
+            logger.error(f"Error loading wallet cursor for {address}: {e}")
+            return None, []
+    
+    def save(self, address: str, last_sig: str, txs: List[ParsedTx]):
+        try:
+            txs_json = orjson.dumps([tuple(tx) for tx in txs])
+            with self._lock:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO wallet_cursor (addr, last_sig, txs_json) VALUES (?, ?, ?)",
+                    (address, last_sig, txs_json)
+                )
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Error saving wallet cursor for {address}: {e}")
+    
+    def load_symbols(self, mints: List[str]) -> Dict[str, Optional[str]]:
+        """Unexpired symbols for the given mints; None marks a mint no source could resolve"""
+        if not mints:
+            return {}
+        try:
+            placeholders = ','.join('?' * len(mints))
+            with self._lock:
+                rows = self._connect().execute(
+                    f"SELECT mint, symbol FROM token_symbol WHERE expires_at > ? AND mint IN ({placeholders})",
+                    (int(time.time()), *mints)
+                ).fetchall()
+            return dict(rows)
+        except Exception as e:
+            logger.error(f"Error loading token symbols: {e}")
+            return {}
+    
+    def save_symbols(self, symbols: Dict[str, str], misses: List[str]):
+        try:
+            now = int(time.time())
+            rows = [(mint, symbol, now + TOKEN_SYMBOL_TTL) for mint, symbol in symbols.items()]
+            rows += [(mint, None, now + TOKEN_SYMBOL_MISS_TTL) for mint in misses]
+            with self._lock:
+                conn = self._connect()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO token_symbol (mint, symbol, expires_at) VALUES (?, ?, ?)", rows
+                )
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Error saving token symbols: {e}")
+    
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
 
 class WalletAnalyzer:
     def __init__(self):
         self.session = None
-        self.price_cache = {}
+        self.live_prices = TTLCache(maxsize=LIVE_PRICE_CACHE_SIZE, ttl=PRICE_TTL)  # coin id -> price
+        self.inflight_prices = {}  # fetch key -> running price fetch task
+        self.price_failures = TTLCache(maxsize=LIVE_PRICE_CACHE_SIZE, ttl=PRICE_FAILURE_TTL)  # fetch key -> True
+        self.parsed_tx_cache = LRUCache(maxsize=PARSED_TX_CACHE_SIZE)
+        self.raw_cache = TTLCache(maxsize=RAW_CACHE_MAX_ROWS, ttl=RAW_DATA_TTL, getsizeof=raw_rows)  # (kind, address, ...) -> fetched chain data
+        self.inflight_raw = {}  # raw_cache key -> running fetch task
+        self.history_store = WalletHistoryStore(WALLET_DB_PATH)
+        self.wallet_semaphore = asyncio.Semaphore(MAX_CONCURRENT_WALLETS)
+        self.metadata_semaphore = asyncio.Semaphore(METADATA_CONCURRENCY)
+        self.inflight_analyses = {}  # (address, period_days) -> running analysis task
+        self.helius_rpc_limiter = AsyncLimiter(HELIUS_RPC_RPS, 1)
+        self.helius_das_limiter = AsyncLimiter(HELIUS_DAS_RPS, 1)
+        self.coingecko_limiter = AsyncLimiter(COINGECKO_RPM, 60)
+        # Capacity 1 spaces Etherscan calls evenly; a burst of ETHERSCAN_RPS can trip its per-second window
+        self.etherscan_limiter = AsyncLimiter(1, 1 / ETHERSCAN_RPS)
         
     async def init_session(self):
         if not self.session:
-            self.session = aiohttp.ClientSession()
+            # One keep-alive pool for the bot's lifetime, so repeat calls to
+            # Helius/Etherscan/CoinGecko skip the TCP+TLS handshake. There is no
+            # await between the check and the assignment, so concurrent callers
+            # cannot race into creating a second session.
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_SIZE,
+                limit_per_host=HTTP_POOL_SIZE_PER_HOST,
+                use_dns_cache=True,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+                enable_cleanup_closed=True
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT)
+            )
+    
+    async def warm_up(self):
+        """Resolve DNS and open keep-alive connections to each upstream so the first /analyze skips the cold path"""
+        await self.init_session()
+        
+        async def touch(method: str, url: StrOrURL, **kwargs):
+            try:
+                async with self.session.request(method, url, **kwargs) as response:
+                    await response.read()
+            except Exception as e:
+                logger.warning(f"Warm-up of {URL(url).host} failed: {error_text(e)}")
+        
+        targets = [touch('GET', COINGECKO_API_URL / 'ping'), touch('GET', ETHERSCAN_API_URL)]
+        if HELIUS_API_KEY:
+            health_payload = {"jsonrpc": "2.0", "id": 1, "method": "getHealth"}
+            targets.append(touch('POST', self._solana_rpc_url(), data=orjson.dumps(health_payload), headers=JSON_HEADERS))
+            targets.append(touch('GET', HELIUS_API_URL.origin()))
+        await asyncio.gather(*targets)
     
     async def close_session(self):
         if self.session:
             await self.session.close()
+        self.history_store.close()
     
-    async def get_sol_price(self, timestamp: Optional[int] = None) -> float:
+    async def _request_json(self, method: str, url: StrOrURL, limiter: Optional[AsyncLimiter],
+                            decode: Callable[[bytes], Any] = orjson.loads, retries: int = MAX_RETRIES, **kwargs):
+        """Rate-limited request returning decoded JSON; raises UpstreamError on HTTP errors.
+        
+        429/5xx responses, connection failures and bodies the decoder flags with
+        RateLimitedReply are retried up to `retries` times with exponential
+        backoff and jitter, honouring the upstream's Retry-After when given.
+        """
         await self.init_session()
-        try:
-            cache_key = f"sol_{timestamp}"
-            if cache_key in self.price_cache:
-                return self.price_cache[cache_key]
-            
-            if timestamp:
-                date_str = datetime.fromtimestamp(timestamp).strftime('%d-%m-%Y')
-                url = f"https://api.coingecko.com/api/v3/coins/solana/history"
-                params = {'date': date_str}
-            else:
-                url = "https://api.coingecko.com/api/v3/simple/price"
-                params = {'ids': 'solana', 'vs_currencies': 'usd'}
-            
-            async with self.session.get(url, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if timestamp:
-                        price = data.get('market_data', {}).get('current_price', {}).get('usd', 0)
+        host = URL(url).host
+        for attempt in range(retries + 1):
+            if limiter is not None:
+                await limiter.acquire()
+            try:
+                async with self.session.request(method, url, **kwargs) as response:
+                    if response.status < 400:
+                        try:
+                            return decode(await response.read())
+                        except RateLimitedReply:
+                            reason = "rate limited"
+                            retryable = True
                     else:
-                        price = data.get('solana', {}).get('usd', 0)
-                    self.price_cache[cache_key] = price
-                    return price
-            return 0
-        except Exception as e:
-            logger.error(f"Error getting SOL price: {e}")
-            return 0
+                        reason = f"HTTP {response.status}"
+                        retryable = response.status in RETRY_STATUSES
+                    if not retryable or attempt == retries:
+                        raise UpstreamError(host, reason, response.status)
+                    delay = retry_delay(attempt, response.headers.get('Retry-After'))
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                reason = type(e).__name__
+                if attempt == retries:
+                    raise UpstreamError(host, reason) from e
+                delay = retry_delay(attempt)
+            logger.warning(f"{method} {host} failed ({reason}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+    
+    async def _get_json(self, url: StrOrURL, limiter: Optional[AsyncLimiter], **kwargs):
+        return await self._request_json('GET', url, limiter, **kwargs)
+    
+    async def _post_json(self, url: StrOrURL, payload, limiter: Optional[AsyncLimiter]):
+        return await self._request_json('POST', url, limiter, data=orjson.dumps(payload), headers=JSON_HEADERS)
+    
+    async def _get_etherscan(self, url: StrOrURL, decode: Callable[[bytes], Any] = orjson.loads):
+        """Etherscan GET whose rate-limit replies (HTTP 200, status '0') are retried like a 429"""
+        def checked_decode(body: bytes):
+            data = decode(body)
+            if etherscan_rate_limited(data):
+                raise RateLimitedReply()
+            return data
+        return await self._get_json(url, self.etherscan_limiter, decode=checked_decode)
     
-    async def get_eth_price(self, timestamp: Optional[int] = None) -> float:
+    async def get_prices_batch(self, coin_ids: Tuple[str, ...] = PRICE_COIN_IDS) -> Dict[str, float]:
+        """Live USD prices for several coins from a single simple/price call"""
+        url = COINGECKO_API_URL / 'simple' / 'price'
+        params = {'ids': ','.join(coin_ids), 'vs_currencies': 'usd'}
+        data = await self._get_json(url, self.coingecko_limiter, params=params, headers=COINGECKO_HEADERS,
+                                    retries=PRICE_MAX_RETRIES)
+        
+        prices = {}
+        for coin_id in coin_ids:
+            prices[coin_id] = data.get(coin_id, {}).get('usd', 0)
+            self.live_prices[coin_id] = prices[coin_id]
+        return prices
+    
+    async def get_coin_price(self, coin_id: str) -> float:
+        """Live USD price for a CoinGecko coin id.
+        
+        Prices are reused for PRICE_TTL seconds. Concurrent misses share a
+        single request, and a failed lookup returns 0 for PRICE_FAILURE_TTL
+        seconds without refetching.
+        """
         await self.init_session()
+        price = self.live_prices.get(coin_id)
+        if price is not None:
+            return price
+        
+        # Live prices for every tracked coin arrive in one call, so their misses share a fetch
+        fetch_key = 'live' if coin_id in PRICE_COIN_IDS else coin_id
+        if fetch_key in self.price_failures:
+            return 0
+        task = self.inflight_prices.get(fetch_key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_price(coin_id, fetch_key))
+            self.inflight_prices[fetch_key] = task
+            task.add_done_callback(lambda _: self.inflight_prices.pop(fetch_key, None))
+        # Shield so one caller timing out does not cancel the fetch for the others
+        await asyncio.shield(task)
+        return self.live_prices.get(coin_id, 0)
+    
+    async def _fetch_price(self, coin_id: str, fetch_key: str):
+        """Fill the price cache for one get_coin_price miss; failures are logged and remembered, never raised"""
         try:
-            cache_key = f"eth_{timestamp}"
-            if cache_key in self.price_cache:
-                return self.price_cache[cache_key]
-            
-            if timestamp:
-                date_str = datetime.fromtimestamp(timestamp).strftime('%d-%m-%Y')
-                url = f"https://api.coingecko.com/api/v3/coins/ethereum/history"
-                params = {'date': date_str}
+            if coin_id in PRICE_COIN_IDS:
+                await self.get_prices_batch()
             else:
-                url = "https://api.coingecko.com/api/v3/simple/price"
-                params = {'ids': 'ethereum', 'vs_currencies': 'usd'}
-            
-            async with self.session.get(url, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if timestamp:
-                        price = data.get('market_data', {}).get('current_price', {}).get('usd', 0)
-                    else:
-                        price = data.get('ethereum', {}).get('usd', 0)
-                    self.price_cache[cache_key] = price
-                    return price
-            return 0
+                await self.get_prices_batch((coin_id,))
         except Exception as e:
-            logger.error(f"Error getting ETH price: {e}")
-            return 0
+            logger.error(f"Error getting {coin_id} price: {error_text(e)}")
+            self.price_failures[fetch_key] = True
+    
+    async def get_sol_price(self) -> float:
+        return await self.get_coin_price('solana')
+    
+    async def get_eth_price(self) -> float:
+        return await self.get_coin_price('ethereum')
     
-    async def detect_chain(self, address: str) -> str:
-        if len(address) == 42 and address.startswith('0x'):
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def detect_chain(address: str) -> str:
+        if ETH_ADDRESS_RE.fullmatch(address):
             return 'ethereum'
-        elif len(address) >= 32 and len(address) <= 44 and not address.startswith('0x'):
+        elif SOL_ADDRESS_RE.fullmatch(address):
             return 'solana'
         else:
             return 'unknown'
     
-    async def calculate_token_pnl(self, token_txs: List, address: str, days: Optional[int] = None) -> Dict:
-        now = datetime.now()
-        cutoff = now - timedelta(days=days) if days else datetime.fromtimestamp(0)
+    def calculate_token_pnl(self, token_txs: List[EthTokenTx], addr_lc: str, days: Optional[int] = None) -> Dict:
+        """Per-token buy/sell totals for a wallet; addr_lc must already be lowercase, as Etherscan's addresses are"""
+        # Compare raw unix timestamps; only the winning position's hold time is turned into days
+        cutoff_ts = period_cutoff(days)
         
-        token_positions = {}
-        trades = []
+        # Positions are stored column-wise: token address -> index into the parallel lists
+        position_index = {}
+        symbols, buy_values, sell_values, first_ts, last_ts = [], [], [], [], []
+        trade_count = 0
         
+        # tokentx is requested newest first, so nothing after the first older row is in the period
         for tx in token_txs:
-            tx_time = datetime.fromtimestamp(int(tx['timeStamp']))
-            if tx_time < cutoff:
-                continue
-            
-            token_addr = tx['contractAddress']
-            token_symbol = tx.get('tokenSymbol', 'UNKNOWN')
-            value = float(tx['value']) / (10 ** int(tx.get('tokenDecimal', 18)))
-            is_buy = tx['to'].lower() == address.lower()
-            
-            if token_addr not in token_positions:
-                token_positions[token_addr] = {
-                    'symbol': token_symbol,
-                    'amount': 0,
-                    'buy_value': 0,
-                    'sell_value': 0,
-                    'first_trade': tx_time,
-                    'last_trade': tx_time
-                }
-            
-            pos = token_positions[token_addr]
-            
-            if is_buy:
-                pos['amount'] += value
-                pos['buy_value'] += value
-            else:
-                pos['amount'] -= value
-                pos['sell_value'] += value
+            tx_ts = tx.timestamp
+            if tx_ts < cutoff_ts:
+                break
+            
+            token_addr = tx.contract
+            value = tx.amount
+            
+            i = position_index.get(token_addr)
+            if i is None:
+                i = position_index[token_addr] = len(symbols)
+                symbols.append(tx.symbol)
+                buy_values.append(0.0)
+                sell_values.append(0.0)
+                first_ts.append(tx_ts)
+                last_ts.append(tx_ts)
             
-            pos['last_trade'] = tx_time
+            if tx.to_addr == addr_lc:
+                buy_values[i] += value
+            else:
+                sell_values[i] += value
             
-            trades.append({
-                'token': token_symbol,
-                'type': 'BUY' if is_buy else 'SELL',
-                'amount': value,
-                'time': tx_time,
-                'hash': tx['hash']
-            })
+            # Etherscan returns newest first, so track both ends explicitly
+            if tx_ts < first_ts[i]:
+                first_ts[i] = tx_ts
+            elif tx_ts > last_ts[i]:
+                last_ts[i] = tx_ts
+            trade_count += 1
         
-        total_pnl = 0
+        pnls = [sell - buy for buy, sell in zip(buy_values, sell_values)]
+        total_pnl = sum(pnls)
         most_profitable = None
-        max_profit = float('-inf')
         
-        for token_addr, pos in token_positions.items():
-            pnl = pos['sell_value'] - pos['buy_value']
-            total_pnl += pnl
-            
-            if pnl > max_profit:
-                max_profit = pnl
-                hold_time = (pos['last_trade'] - pos['first_trade']).days
-                most_profitable = {
-                    'token': pos['symbol'],
-                    'pnl': pnl,
-                    'hold_days': hold_time
-                }
+        if pnls:
+            best = max(range(len(pnls)), key=pnls.__getitem__)
+            most_profitable = {
+                'token': symbols[best],
+                'pnl': pnls[best],
+                'hold_days': (last_ts[best] - first_ts[best]) // 86400
+            }
         
         return {
             'total_pnl': total_pnl,
-            'total_trades': len(trades),
+            'total_trades': trade_count,
             'most_profitable': most_profitable,
-            'positions': len(token_positions)
+            'positions': len(symbols)
         }
     
-    async def get_solana_token_metadata(self, mint_address: str) -> str:
-        """Get token symbol from mint address using Helius or Jupiter"""
+    async def get_solana_token_metadata(self, mint_address: str) -> Optional[str]:
+        """Get token symbol from mint address using Jupiter; None when Jupiter does not list it"""
         await self.init_session()
         
+        # Jupiter token list is public, no auth needed
+        url = JUPITER_TOKEN_URL / mint_address
         try:
-            # Try Jupiter token list first (public, no auth needed)
-            url = "https://tokens.jup.ag/token/" + mint_address
-            async with self.session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    symbol = data.get('symbol')
+            async with self.metadata_semaphore:
+                data = await self._get_json(url, None)
+        except UpstreamError as e:
+            if e.status == 404:
+                return None
+            raise
+        return data.get('symbol') or None
+    
+    async def get_solana_token_symbols(self, mints: List[str]) -> Dict[str, str]:
+        """Resolve symbols for many mints with one Helius getAssetBatch call, falling back to Jupiter.
+        
+        Symbols are effectively immutable, so results (including mints neither
+        source knows) are persisted and survive restarts.
+        """
+        stored = await asyncio.to_thread(self.history_store.load_symbols, mints)
+        symbols = {mint: symbol for mint, symbol in stored.items() if symbol}
+        # Known misses keep the shortened-address label without another lookup
+        symbols.update((mint, mint[:6] + '...') for mint, symbol in stored.items() if not symbol)
+        mints = [mint for mint in mints if mint not in stored]
+        found = {}
+        
+        if HELIUS_API_KEY and mints:
+            payload = {
+                "jsonrpc": "2.0",
+                "id": "1",
+                "method": "getAssetBatch",
+                "params": {"ids": mints[:DAS_BATCH_SIZE], "options": {"showFungible": True}}
+            }
+            try:
+                data = await self._post_json(self._solana_rpc_url(), payload, self.helius_das_limiter)
+                for asset in data.get('result') or []:
+                    if not asset:
+                        continue
+                    symbol = (asset.get('content', {}).get('metadata', {}).get('symbol')
+                              or asset.get('token_info', {}).get('symbol'))
                     if symbol:
-                        return symbol
-            
-            # If Helius available, try DAS API
-            if HELIUS_API_KEY:
-                url = f"https://mainnet.helius-rpc.com/?api-key={HELIUS_API_KEY}"
-                payload = {
-                    "jsonrpc": "2.0",
-                    "id": "1",
-                    "method": "getAsset",
-                    "params": {"id": mint_address}
-                }
-                async with self.session.post(url, json=payload) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        result = data.get('result', {})
-                        content = result.get('content', {})
-                        metadata = content.get('metadata', {})
-                        symbol = metadata.get('symbol')
-                        if symbol:
-                            return symbol
-            
-            # Fallback to shortened mint address
-            return mint_address[:6] + '...'
+                        found[asset.get('id')] = symbol
+            except Exception as e:
+                logger.error(f"Error getting token metadata batch: {error_text(e)}")
+        
+        unresolved = [mint for mint in mints if mint not in found][:10]  # Limit to 10 to avoid Jupiter rate limits
+        fallbacks = await asyncio.gather(
+            *[self.get_solana_token_metadata(mint) for mint in unresolved],
+            return_exceptions=True
+        )
+        misses = []
+        for mint, symbol in zip(unresolved, fallbacks):
+            if isinstance(symbol, Exception):
+                logger.error(f"Error getting token metadata: {error_text(symbol)}")
+                symbols[mint] = mint[:6] + '...'
+            elif symbol:
+                found[mint] = symbol
+            else:
+                # Fallback to shortened mint address
+                misses.append(mint)
+                symbols[mint] = mint[:6] + '...'
+        
+        if found or misses:
+            await asyncio.to_thread(self.history_store.save_symbols, found, misses)
+        symbols.update(found)
+        return symbols
+    
+    def get_parsed_tx(self, tx: HeliusTx) -> ParsedTx:
+        """Parse an enhanced transaction, reusing earlier parses of the same signature"""
+        signature = tx.signature
+        if not signature:
+            return parse_enhanced_tx(tx)
+        
+        parsed = self.parsed_tx_cache.get(signature)
+        if parsed is None:
+            parsed = parse_enhanced_tx(tx)
+            self.parsed_tx_cache[signature] = parsed
+        return parsed
+    
+    async def _cached_raw(self, cache_key: Tuple, fetch: Callable[[], Awaitable[Tuple[Any, bool]]],
+                          usable: Callable[[Any], bool] = lambda cached: True):
+        """Chain data from raw_cache, fetched at most once per key even when callers overlap.
+        
+        fetch returns (data, cacheable); data that is None or incomplete is
+        handed back to every caller sharing that fetch but not stored. Cached
+        data that usable() rejects (say, too shallow for the caller) is fetched
+        again and replaced.
+        """
+        cached = self.raw_cache.get(cache_key)
+        if cached is not None and usable(cached):
+            return cached
+        
+        # Share a running fetch; if its result is too shallow for this caller, fetch again below
+        task = self.inflight_raw.get(cache_key)
+        if task is not None:
+            data = await asyncio.shield(task)
+            if data is None or usable(data):
+                return data
+        
+        async def fetch_and_store():
+            try:
+                data, cacheable = await fetch()
+                if cacheable and data is not None:
+                    try:
+                        self.raw_cache[cache_key] = data
+                    except ValueError:
+                        pass  # larger than the whole cache; serve it uncached
+                return data
+            finally:
+                # Leave the map before any waiter resumes; a deeper fetch may have replaced this one
+                if self.inflight_raw.get(cache_key) is task:
+                    del self.inflight_raw[cache_key]
+        
+        task = asyncio.ensure_future(fetch_and_store())
+        self.inflight_raw[cache_key] = task
+        # Shield so one caller timing out does not cancel the fetch for the others
+        return await asyncio.shield(task)
+    
+    async def get_solana_history(self, address: str) -> Optional[List[ParsedTx]]:
+        """Parsed enhanced transactions for a wallet, newest first.
+        
+        Only transactions newer than the wallet's stored cursor are fetched; they
+        are merged onto the persisted history, capped at WALLET_HISTORY_LIMIT.
+        Period filtering happens client-side, so a recent result is reused for
+        RAW_DATA_TTL seconds across every period button.
+        """
+        return await self._cached_raw(('history', address), lambda: self._fetch_solana_history(address))
+    
+    async def _fetch_solana_history(self, address: str) -> Tuple[Optional[List[ParsedTx]], bool]:
+        last_sig, stored_txs = await asyncio.to_thread(self.history_store.load, address)
+        
+        # One enhanced-transactions call feeds both activity stats and swap P&L,
+        # so getSignaturesForAddress is not needed when Helius is configured
+        url = HELIUS_API_URL / 'addresses' / address / 'transactions'
+        new_txs = []
+        newest_sig = None
+        before = None
+        complete = True
+        
+        # Pages are chained by signature cursor, so they are walked in order until
+        # the stored cursor is reached, a short page ends the history, or the cap is hit
+        while len(new_txs) < WALLET_HISTORY_LIMIT:
+            params = {
+                'api-key': HELIUS_API_KEY,
+                'limit': HELIUS_PAGE_LIMIT
+            }
+            if last_sig:
+                params['until'] = last_sig
+            if before:
+                params['before'] = before
             
-        except Exception as e:
-            logger.error(f"Error getting token metadata: {e}")
-            return mint_address[:6] + '...' if mint_address else 'UNKNOWN'
+            try:
+                raw_transactions = await self._get_json(
+                    url, self.helius_rpc_limiter, params=params, decode=HELIUS_TXS_DECODER.decode
+                )
+            except UpstreamError as e:
+                logger.error(f"Helius API error: {e}")
+                complete = False
+            except msgspec.MsgspecError as e:
+                logger.warning(f"Unexpected Helius transactions response: {e}")
+                complete = False
+            
+            if not complete:
+                if not new_txs:
+                    return None, False
+                break
+            
+            if not raw_transactions:
+                break
+            
+            newest_sig = newest_sig or raw_transactions[0].signature
+            before = raw_transactions[-1].signature
+            page_size = len(raw_transactions)
+            # Compact each page straight away so the raw JSON tree is not kept
+            # alive across the remaining page, metadata and price awaits
+            new_txs.extend(self.get_parsed_tx(tx) for tx in raw_transactions)
+            del raw_transactions
+            
+            if page_size < HELIUS_PAGE_LIMIT:
+                break
+        
+        if not complete:
+            # A failed page leaves a hole between the fresh transactions and the
+            # stored ones, so serve what was fetched without persisting a cursor
+            return new_txs[:WALLET_HISTORY_LIMIT], False
+        
+        if not new_txs:
+            return stored_txs, True
+        
+        transactions = (new_txs + stored_txs)[:WALLET_HISTORY_LIMIT]
+        if newest_sig:
+            await asyncio.to_thread(self.history_store.save, address, newest_sig, transactions)
+        return transactions, True
     
     async def analyze_solana_transactions_detailed(self, address: str, period_days: Optional[int] = None):
         await self.init_session()
@@ -220,231 +858,366 @@ class WalletAnalyzer:
             return None
         
         try:
-            now = datetime.now()
-            cutoff = now - timedelta(days=period_days) if period_days else datetime.fromtimestamp(0)
+            cutoff_ts = period_cutoff(period_days)
             
-            # Use correct Helius endpoint with pagination
-            url = f"https://api.helius.xyz/v0/addresses/{address}/transactions"
-            params = {
-                'api-key': HELIUS_API_KEY,
-                'limit': 100,
-                'type': 'SWAP'  # Focus on swap transactions
-            }
-            
-            async with self.session.get(url, params=params) as response:
-                if response.status != 200:
-                    logger.error(f"Helius API error: {response.status}")
-                    return None
-                transactions = await response.json()
-            
-            if not transactions or not isinstance(transactions, list):
-                logger.warning("No transactions returned from Helius")
+            transactions = await self.get_solana_history(address)
+            if transactions is None:
                 return None
             
-            token_balances = defaultdict(lambda: {'in': 0, 'out': 0, 'first_time': None, 'last_time': None, 'symbol': 'UNKNOWN'})
-            sol_in = 0
-            sol_out = 0
-            swap_count = 0
+            pnl = SolanaPnlState(address)
+            period_tx_count = 0
             most_profitable_token = None
             max_token_profit = float('-inf')
             
-            for tx in transactions:
-                timestamp = tx.get('timestamp', 0)
-                tx_time = datetime.fromtimestamp(timestamp)
-                
-                # Apply time filter
-                if tx_time < cutoff:
-                    continue
-                
-                # Get token transfers
-                token_transfers = tx.get('tokenTransfers', [])
-                
-                for transfer in token_transfers:
-                    mint = transfer.get('mint', '')
-                    amount = float(transfer.get('tokenAmount', 0))
-                    from_addr = transfer.get('fromUserAccount', '')
-                    to_addr = transfer.get('toUserAccount', '')
-                    
-                    # Try to get symbol from transfer data first
-                    symbol = transfer.get('tokenSymbol') or transfer.get('symbol')
-                    
-                    if from_addr == address:
-                        token_balances[mint]['out'] += amount
-                        if symbol:
-                            token_balances[mint]['symbol'] = symbol
-                        token_balances[mint]['last_time'] = tx_time
-                    elif to_addr == address:
-                        token_balances[mint]['in'] += amount
-                        if symbol:
-                            token_balances[mint]['symbol'] = symbol
-                        if not token_balances[mint]['first_time']:
-                            token_balances[mint]['first_time'] = tx_time
-                        token_balances[mint]['last_time'] = tx_time
-                
-                # Track SOL movements
-                native_transfers = tx.get('nativeTransfers', [])
-                for transfer in native_transfers:
-                    amount = float(transfer.get('amount', 0)) / 1e9
-                    from_addr = transfer.get('fromUserAccount', '')
-                    to_addr = transfer.get('toUserAccount', '')
-                    
-                    if from_addr == address:
-                        sol_out += amount
-                    elif to_addr == address:
-                        sol_in += amount
+            last_active_ts = transactions[0].timestamp if transactions else None
+            
+            for parsed in transactions:
+                # History is newest first, so everything after this is outside the period
+                if parsed.timestamp < cutoff_ts:
+                    break
                 
-                # Count swaps
-                tx_type = tx.get('type', '')
-                if tx_type in ['SWAP', 'TRADE']:
-                    swap_count += 1
+                period_tx_count += 1
+                TX_HANDLERS.get(parsed.type, handle_ignored_tx)(parsed, pnl)
+            
+            token_balances = aggregate_transfers(pnl.transfers)
+            symbols = pnl.symbols
             
             # Fetch token metadata for any unknown symbols
-            unknown_tokens = [mint for mint, data in token_balances.items() 
-                            if data['symbol'] == 'UNKNOWN' and mint]
+            unknown_tokens = [mint for mint in token_balances if mint and mint not in symbols]
             
             if unknown_tokens:
                 logger.info(f"Fetching metadata for {len(unknown_tokens)} tokens...")
-                for mint in unknown_tokens[:10]:  # Limit to 10 to avoid rate limits
-                    symbol = await self.get_solana_token_metadata(mint)
-                    token_balances[mint]['symbol'] = symbol
+                symbols.update(await self.get_solana_token_symbols(unknown_tokens))
             
             # Calculate most profitable token
-            for mint, balance in token_balances.items():
-                profit = balance['in'] - balance['out']
-                if profit > max_token_profit and balance['in'] > 0:
+            for mint, (bought, sold, first_ts, last_ts) in token_balances.items():
+                profit = bought - sold
+                if profit > max_token_profit and bought > 0:
                     max_token_profit = profit
-                    hold_days = 0
-                    if balance['first_time'] and balance['last_time']:
-                        hold_days = (balance['last_time'] - balance['first_time']).days
-                    
                     most_profitable_token = {
-                        'token': balance['symbol'],
+                        'token': symbols.get(mint, 'UNKNOWN'),
                         'pnl': profit,
-                        'hold_days': hold_days
+                        'hold_days': (last_ts - first_ts) // 86400
                     }
             
             # Calculate SOL P&L in USD
             current_sol_price = await self.get_sol_price()
-            sol_pnl = sol_in - sol_out
+            sol_pnl = (pnl.lamports_in - pnl.lamports_out) / 1e9
             sol_pnl_usd = sol_pnl * current_sol_price
             
-            logger.info(f"Solana analysis complete: {swap_count} swaps, {len(token_balances)} tokens")
+            logger.info(f"Solana analysis complete: {pnl.swap_count} swaps, {len(token_balances)} tokens")
             
             return {
                 'sol_pnl': sol_pnl,
                 'sol_pnl_usd': sol_pnl_usd,
-                'swap_count': swap_count,
+                'swap_count': pnl.swap_count,
                 'most_profitable': most_profitable_token,
-                'active_tokens': len([b for b in token_balances.values() if b['in'] > 0])
+                'active_tokens': sum(1 for bought, _, _, _ in token_balances.values() if bought > 0),
+                'last_active_ts': last_active_ts,
+                'total_transactions': period_tx_count
             }
             
         except Exception as e:
-            logger.error(f"Error in detailed Solana analysis: {e}")
+            logger.error(f"Error in detailed Solana analysis: {error_text(e)}")
             return None
     
-    async def analyze_ethereum_wallet(self, address: str, period_days: Optional[int] = None) -> Dict:
+    async def get_ethereum_raw(self, address: str, cutoff_ts: int = 0,
+                               balance_wei: Optional[int] = None) -> Optional[EthereumRaw]:
+        """Normal transactions, token transfers and balance in wei for a wallet, newest first.
+        
+        The lists are paged only as deep as cutoff_ts needs, and reused for
+        RAW_DATA_TTL seconds by any later period they cover, so period switches
+        only recompute the metrics. Returns None when Etherscan has no
+        transaction list for the address. A balance already fetched through
+        balancemulti skips the balance call.
+        """
+        return await self._cached_raw(
+            ('ethereum', address),
+            lambda: self._fetch_ethereum_raw(address, cutoff_ts, balance_wei),
+            usable=lambda raw: raw.covered_from <= cutoff_ts
+        )
+    
+    async def _fetch_etherscan_pages(self, address: str, action: str, decoder: msgspec.json.Decoder,
+                                     cutoff_ts: int) -> Tuple[Optional[list], int]:
+        """One Etherscan account list, newest first, paged until a row at or before cutoff_ts.
+        
+        Returns (rows, covered_from) as in EthereumRaw; rows is None when the
+        address has no transactions. Etherscan reports errors as HTTP 200 with
+        status '0' and a message as the result; those raise UpstreamError so
+        they are never mistaken for (and cached as) an empty history.
+        """
+        query = {'module': 'account', 'action': action, 'address': address, 'startblock': 0,
+                 'endblock': 99999999, 'offset': ETHERSCAN_PAGE_SIZE, 'sort': 'desc', 'apikey': ETHERSCAN_API_KEY}
+        rows = []
+        for page in range(1, ETHERSCAN_MAX_ROWS // ETHERSCAN_PAGE_SIZE + 1):
+            url = ETHERSCAN_API_URL.update_query(query).update_query(page=page)
+            data = await self._get_etherscan(url, decoder.decode)
+            if data.status != '1':
+                if isinstance(data.result, str):
+                    raise UpstreamError(ETHERSCAN_API_URL.host, f"Etherscan error ({data.result})")
+                # "No transactions found" (also past the last page) comes with an empty list
+                if page == 1:
+                    return None, 0
+                break
+            rows.extend(data.result)
+            if len(data.result) < ETHERSCAN_PAGE_SIZE:
+                break
+            if rows[-1].timestamp <= cutoff_ts:
+                return rows, rows[-1].timestamp
+        return rows, 0
+    
+    async def _fetch_ethereum_raw(self, address: str, cutoff_ts: int,
+                                  balance_wei: Optional[int]) -> Tuple[Optional[EthereumRaw], bool]:
+        balance_url = ETHERSCAN_API_URL.update_query(module='account', action='balance', address=address,
+                                                   tag='latest', apikey=ETHERSCAN_API_KEY)
+        
+        # The lookups are independent; issue them together over the pooled session.
+        # Only the transaction list is essential, so the others may fail on their own.
+        fetches = [
+            self._fetch_etherscan_pages(address, 'txlist', ETHERSCAN_TXLIST_DECODER, cutoff_ts),
+            self._fetch_etherscan_pages(address, 'tokentx', ETHERSCAN_TOKENTX_DECODER, cutoff_ts),
+        ]
+        if balance_wei is None:
+            fetches.append(self._get_etherscan(balance_url))
+        tx_data, token_data, *balance_data = await asyncio.gather(*fetches, return_exceptions=True)
+        
+        if isinstance(tx_data, BaseException):
+            raise tx_data
+        transactions, covered_from = tx_data
+        if transactions is None:
+            return None, False
+        
+        complete = True
+        token_txs = []
+        if isinstance(token_data, BaseException):
+            logger.error(f"Error fetching token transfers for {address}: {error_text(token_data)}")
+            complete = False
+        else:
+            token_rows, token_covered_from = token_data
+            token_txs = scale_token_transfers(token_rows or [])
+            covered_from = max(covered_from, token_covered_from)
+        if balance_data:
+            balance_data, = balance_data
+            balance_wei = 0
+            if isinstance(balance_data, BaseException):
+                logger.error(f"Error fetching balance for {address}: {error_text(balance_data)}")
+                complete = False
+            elif balance_data['status'] == '1':
+                balance_wei = int(balance_data['result'])
+            else:
+                logger.error(f"Etherscan balance error for {address}: {balance_data.get('result')}")
+                complete = False
+        
+        # A partial result is still shown, but not reused for later period switches
+        return EthereumRaw(transactions, token_txs, balance_wei, covered_from), complete
+    
+    async def analyze_ethereum_wallet(self, address: str, period_days: Optional[int] = None,
+                                      balance_wei: Optional[int] = None) -> Dict:
         await self.init_session()
         
         try:
-            tx_url = f"https://api.etherscan.io/api?module=account&action=txlist&address={address}&startblock=0&endblock=99999999&sort=desc&apikey={ETHERSCAN_API_KEY}"
-            async with self.session.get(tx_url) as response:
-                tx_data = await response.json()
-            
-            if tx_data['status'] != '1':
+            # The price doesn't depend on the wallet, so fetch it alongside the Etherscan calls
+            raw, current_eth_price = await asyncio.gather(
+                self.get_ethereum_raw(address, period_cutoff(period_days), balance_wei),
+                self.get_eth_price()
+            )
+            if raw is None:
                 return {'error': 'Failed to fetch transactions'}
             
-            transactions = tx_data['result']
-            
-            token_url = f"https://api.etherscan.io/api?module=account&action=tokentx&address={address}&startblock=0&endblock=99999999&sort=desc&apikey={ETHERSCAN_API_KEY}"
-            async with self.session.get(token_url) as response:
-                token_data = await response.json()
-            
-            token_txs = token_data['result'] if token_data['status'] == '1' else []
-            
-            balance_url = f"https://api.etherscan.io/api?module=account&action=balance&address={address}&tag=latest&apikey={ETHERSCAN_API_KEY}"
-            async with self.session.get(balance_url) as response:
-                balance_data = await response.json()
-            
-            eth_balance = int(balance_data['result']) / 1e18 if balance_data['status'] == '1' else 0
-            
-            now = datetime.now()
-            cutoff = now - timedelta(days=period_days) if period_days else datetime.fromtimestamp(0)
-            
-            period_txs = [tx for tx in transactions if datetime.fromtimestamp(int(tx['timeStamp'])) > cutoff]
-            period_token_txs = [tx for tx in token_txs if datetime.fromtimestamp(int(tx['timeStamp'])) > cutoff]
-            
-            eth_in = sum(int(tx['value']) for tx in period_txs if tx['to'].lower() == address.lower()) / 1e18
-            eth_out = sum(int(tx['value']) for tx in period_txs if tx['from'].lower() == address.lower()) / 1e18
-            
-            current_eth_price = await self.get_eth_price()
-            eth_pnl_usd = (eth_in - eth_out) * current_eth_price
-            
-            token_pnl_data = await self.calculate_token_pnl(period_token_txs, address, period_days)
-            
-            last_active = datetime.fromtimestamp(int(transactions[0]['timeStamp'])) if transactions else None
-            last_trade = datetime.fromtimestamp(int(token_txs[0]['timeStamp'])) if token_txs else None
-            
-            return {
-                'chain': 'Ethereum',
-                'address': address,
-                'last_active': last_active,
-                'last_trade': last_trade,
-                'current_balance': eth_balance,
-                'current_balance_usd': eth_balance * current_eth_price,
-                'total_transactions': len(period_txs),
-                'total_token_transfers': len(period_token_txs),
-                'eth_pnl': eth_in - eth_out,
-                'eth_pnl_usd': eth_pnl_usd,
-                'token_pnl': token_pnl_data,
-                'period_days': period_days or 'All Time'
-            }
+            return self.compute_ethereum_metrics(raw, address, period_days, current_eth_price, balance_wei)
             
         except Exception as e:
-            logger.error(f"Error analyzing Ethereum wallet: {e}")
-            return {'error': str(e)}
+            logger.error(f"Error analyzing Ethereum wallet: {error_text(e)}")
+            return {'error': error_text(e)}
+    
+    def compute_ethereum_metrics(self, raw: EthereumRaw, address: str,
+                                 period_days: Optional[int], current_eth_price: float,
+                                 balance_wei: Optional[int] = None) -> Dict:
+        """Period figures for an Ethereum wallet from its cached raw data; no network calls"""
+        transactions, token_txs, cached_balance_wei, _ = raw
+        # A freshly batched balance beats one cached with the transaction lists
+        if balance_wei is None:
+            balance_wei = cached_balance_wei
+        eth_balance = balance_wei / 1e18
+        
+        cutoff_ts = period_cutoff(period_days)
+        # Etherscan returns addresses in lowercase hex, so only the input needs normalising, once
+        addr_lc = address.lower()
+        
+        # tokentx is newest first too, so the period is a prefix of the list
+        period_token_count = 0
+        for tx in token_txs:
+            if tx.timestamp <= cutoff_ts:
+                break
+            period_token_count += 1
+        period_token_txs = token_txs[:period_token_count]
+        
+        # One pass over the period: txlist is newest first, so stop at the cutoff
+        wei_in = wei_out = period_tx_count = 0
+        for tx in transactions:
+            if tx.timestamp <= cutoff_ts:
+                break
+            period_tx_count += 1
+            value = tx.value
+            if tx.to_addr == addr_lc:
+                wei_in += value
+            if tx.from_addr == addr_lc:
+                wei_out += value
+        eth_in = wei_in / 1e18
+        eth_out = wei_out / 1e18
+        
+        eth_pnl_usd = (eth_in - eth_out) * current_eth_price
+        
+        token_pnl_data = self.calculate_token_pnl(period_token_txs, addr_lc, period_days)
+        
+        last_active_ts = transactions[0].timestamp if transactions else None
+        last_trade_ts = token_txs[0].timestamp if token_txs else None
+        
+        return {
+            'chain': 'Ethereum',
+            'address': address,
+            'last_active_ts': last_active_ts,
+            'last_trade_ts': last_trade_ts,
+            'current_balance': eth_balance,
+            'current_balance_usd': eth_balance * current_eth_price,
+            'total_transactions': period_tx_count,
+            'total_token_transfers': len(period_token_txs),
+            'eth_pnl': eth_in - eth_out,
+            'eth_pnl_usd': eth_pnl_usd,
+            'token_pnl': token_pnl_data,
+            'period_days': period_days or 'All Time'
+        }
+    
+    def _solana_rpc_url(self) -> str:
+        if HELIUS_API_KEY:
+            return f"https://mainnet.helius-rpc.com/?api-key={HELIUS_API_KEY}"
+        return "https://api.mainnet-beta.solana.com"
     
-    async def analyze_solana_wallet(self, address: str, period_days: Optional[int] = None) -> Dict:
+    async def get_solana_balances(self, addresses: List[str]) -> Dict[str, int]:
+        """Lamport balances for many wallets using batched JSON-RPC getBalance calls"""
         await self.init_session()
+        rpc_url = self._solana_rpc_url()
         
-        try:
-            if HELIUS_API_KEY:
-                rpc_url = f"https://mainnet.helius-rpc.com/?api-key={HELIUS_API_KEY}"
-            else:
-                rpc_url = "https://api.mainnet-beta.solana.com"
-            
-            balance_payload = {"jsonrpc": "2.0", "id": 1, "method": "getBalance", "params": [address]}
-            
-            async with self.session.post(rpc_url, json=balance_payload) as response:
-                balance_data = await response.json()
-            
-            balance_lamports = balance_data.get('result', {}).get('value', 0)
-            sol_balance = balance_lamports / 1e9
+        async def fetch_batch(batch: List[str]) -> Dict[str, int]:
+            payload = [
+                {"jsonrpc": "2.0", "id": i, "method": "getBalance", "params": [addr]}
+                for i, addr in enumerate(batch)
+            ]
+            try:
+                responses = await self._post_json(rpc_url, payload, self.helius_rpc_limiter)
+            except Exception as e:
+                logger.error(f"Error fetching batched Solana balances: {error_text(e)}")
+                return {}
             
-            sig_payload = {"jsonrpc": "2.0", "id": 1, "method": "getSignaturesForAddress", "params": [address, {"limit": 1000}]}
-            
-            async with self.session.post(rpc_url, json=sig_payload) as response:
-                sig_data = await response.json()
-            
-            signatures = sig_data.get('result', [])
+            balances = {}
+            if isinstance(responses, list):
+                for item in responses:
+                    value = (item.get('result') or {}).get('value')
+                    if value is not None and item.get('id') in range(len(batch)):
+                        balances[batch[item['id']]] = value
+            return balances
+        
+        batches = [addresses[i:i + RPC_BATCH_SIZE] for i in range(0, len(addresses), RPC_BATCH_SIZE)]
+        balances = {}
+        for batch_balances in await asyncio.gather(*[fetch_batch(b) for b in batches]):
+            balances.update(batch_balances)
+        return balances
+    
+    async def get_ethereum_balances(self, addresses: List[str]) -> Dict[str, int]:
+        """Wei balances for many wallets using Etherscan balancemulti calls"""
+        await self.init_session()
+        
+        async def fetch_batch(batch: List[str]) -> Dict[str, int]:
+            url = ETHERSCAN_API_URL.update_query(module='account', action='balancemulti', address=','.join(batch),
+                                               tag='latest', apikey=ETHERSCAN_API_KEY)
+            try:
+                data = await self._get_etherscan(url)
+            except Exception as e:
+                logger.error(f"Error fetching batched Ethereum balances: {error_text(e)}")
+                return {}
+            if data.get('status') != '1':
+                return {}
             
-            now = datetime.now()
-            cutoff = now - timedelta(days=period_days) if period_days else datetime.fromtimestamp(0)
+            # Etherscan may echo the accounts in a different case than requested
+            by_lower = {addr.lower(): addr for addr in batch}
+            balances = {}
+            for item in data.get('result') or []:
+                addr = by_lower.get(str(item.get('account', '')).lower())
+                if addr is not None:
+                    balances[addr] = int(item['balance'])
+            return balances
+        
+        batches = [addresses[i:i + ETHERSCAN_BALANCE_BATCH_SIZE]
+                   for i in range(0, len(addresses), ETHERSCAN_BALANCE_BATCH_SIZE)]
+        balances = {}
+        for batch_balances in await asyncio.gather(*[fetch_batch(b) for b in batches]):
+            balances.update(batch_balances)
+        return balances
+    
+    async def get_solana_activity(self, rpc_url: str, address: str, period_days: Optional[int] = None):
+        """Last active time and period tx count from plain RPC signatures (no Helius needed)"""
+        async def fetch_signatures():
+            sig_payload = {"jsonrpc": "2.0", "id": 1, "method": "getSignaturesForAddress", "params": [address, {"limit": SIGNATURE_LIMIT}]}
+            sig_data = await self._post_json(rpc_url, sig_payload, self.helius_rpc_limiter)
+            # A JSON-RPC error body has no result; show it as empty but don't cache it
+            signatures = sig_data.get('result')
+            if signatures is None:
+                logger.error(f"getSignaturesForAddress failed for {address}: {sig_data.get('error')}")
+                return [], False
+            return signatures, True
+        
+        signatures = await self._cached_raw(('signatures', address, SIGNATURE_LIMIT), fetch_signatures)
+        
+        cutoff_ts = period_cutoff(period_days)
+        
+        # Signatures come back newest first, so count until the first one outside the period
+        period_count = 0
+        for sig in signatures:
+            if (sig.get('blockTime') or 0) <= cutoff_ts:
+                break
+            period_count += 1
+        
+        last_active_ts = signatures[0].get('blockTime') if signatures else None
+        
+        return last_active_ts, period_count
+    
+    async def analyze_solana_wallet(self, address: str, period_days: Optional[int] = None,
+                                    balance_lamports: Optional[int] = None) -> Dict:
+        await self.init_session()
+        
+        try:
+            rpc_url = self._solana_rpc_url()
             
-            period_sigs = [sig for sig in signatures if datetime.fromtimestamp(sig.get('blockTime', 0)) > cutoff]
+            async def fetch_balance() -> int:
+                # Multi-wallet requests pre-fetch balances in one batched RPC call
+                if balance_lamports is not None:
+                    return balance_lamports
+                balance_payload = {"jsonrpc": "2.0", "id": 1, "method": "getBalance", "params": [address]}
+                balance_data = await self._post_json(rpc_url, balance_payload, self.helius_rpc_limiter)
+                return balance_data.get('result', {}).get('value', 0)
             
-            current_sol_price = await self.get_sol_price()
+            # Balance, price and transaction history are independent, so fire them together
+            lamports, current_sol_price, detailed_pnl = await asyncio.gather(
+                fetch_balance(),
+                self.get_sol_price(),
+                self.analyze_solana_transactions_detailed(address, period_days)
+            )
             
-            last_active = datetime.fromtimestamp(signatures[0].get('blockTime', 0)) if signatures else None
+            sol_balance = lamports / 1e9
             
-            detailed_pnl = await self.analyze_solana_transactions_detailed(address, period_days)
+            if detailed_pnl:
+                last_active_ts = detailed_pnl['last_active_ts']
+                total_transactions = detailed_pnl['total_transactions']
+            else:
+                last_active_ts, total_transactions = await self.get_solana_activity(rpc_url, address, period_days)
             
             result = {
                 'chain': 'Solana',
                 'address': address,
-                'last_active': last_active,
+                'last_active_ts': last_active_ts,
                 'current_balance': sol_balance,
                 'current_balance_usd': sol_balance * current_sol_price,
-                'total_transactions': len(period_sigs),
+                'total_transactions': total_transactions,
                 'period_days': period_days or 'All Time',
             }
             
@@ -460,23 +1233,80 @@ class WalletAnalyzer:
             return result
             
         except Exception as e:
-            logger.error(f"Error analyzing Solana wallet: {e}")
-            return {'error': str(e)}
+            logger.error(f"Error analyzing Solana wallet: {error_text(e)}")
+            return {'error': error_text(e)}
+    
+    async def analyze_wallet(self, address: str, period_days: Optional[int] = None,
+                             balance: Optional[int] = None) -> Dict:
+        """Analyze a wallet, sharing one in-flight run between concurrent identical requests.
+        
+        balance is an already-fetched native balance in the chain's base unit
+        (wei or lamports); when omitted it is fetched with the wallet's data.
+        """
+        key = (address, period_days)
+        task = self.inflight_analyses.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._analyze_wallet(address, period_days, balance))
+            self.inflight_analyses[key] = task
+            task.add_done_callback(lambda _: self.inflight_analyses.pop(key, None))
+        # Shield so one caller timing out does not cancel the run for the others
+        return await asyncio.shield(task)
     
-    async def analyze_wallet(self, address: str, period_days: Optional[int] = None) -> Dict:
-        chain = await self.detect_chain(address)
+    async def _analyze_wallet(self, address: str, period_days: Optional[int] = None,
+                              balance: Optional[int] = None) -> Dict:
+        chain = self.detect_chain(address)
         
         if chain == 'ethereum':
-            return await self.analyze_ethereum_wallet(address, period_days)
+            result = await self.analyze_ethereum_wallet(address, period_days, balance)
         elif chain == 'solana':
-            return await self.analyze_solana_wallet(address, period_days)
+            result = await self.analyze_solana_wallet(address, period_days, balance)
         else:
             return {'error': 'Unknown chain or invalid address'}
+        
+        if 'error' not in result:
+            result['short_address'] = f"{address[:8]}...{address[-6:]}"
+        return result
+    
+    async def _analyze_wallet_bounded(self, address: str, period_days: Optional[int] = None,
+                                      balance: Optional[int] = None) -> Dict:
+        async with self.wallet_semaphore:
+            try:
+                return await asyncio.wait_for(self.analyze_wallet(address, period_days, balance), WALLET_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.error(f"Timed out analyzing wallet {address}")
+                return {'error': 'Analysis timed out'}
     
     async def analyze_multiple_wallets(self, addresses: List[str], period_days: Optional[int] = None) -> List[Dict]:
-        tasks = [self.analyze_wallet(addr, period_days) for addr in addresses]
-        results = await asyncio.gather(*tasks)
-        return results
+        sol_addresses = [addr for addr in addresses if self.detect_chain(addr) == 'solana']
+        eth_addresses = [addr for addr in addresses if self.detect_chain(addr) == 'ethereum']
+        
+        async def prefetch_sol_balances() -> Dict[str, int]:
+            return await self.get_solana_balances(sol_addresses) if sol_addresses else {}
+        
+        async def prefetch_eth_balances() -> Dict[str, int]:
+            return await self.get_ethereum_balances(eth_addresses) if eth_addresses else {}
+        
+        # Warm the live price cache once (SOL and ETH share one call) so the
+        # wallets fanned out below all hit the cache instead of CoinGecko.
+        # This runs outside WALLET_TIMEOUT, so it gets its own bound.
+        try:
+            sol_balances, eth_balances, _ = await asyncio.wait_for(
+                asyncio.gather(prefetch_sol_balances(), prefetch_eth_balances(), self.get_sol_price()),
+                PREFETCH_TIMEOUT
+            )
+            balances = {**sol_balances, **eth_balances}
+        except asyncio.TimeoutError:
+            logger.warning(f"Prefetch for {len(addresses)} wallet(s) timed out; wallets will fetch their own balances")
+            balances = {}
+        
+        # Structured fan-out: if anything escapes a wallet's own error handling,
+        # the remaining analyses are cancelled instead of left running
+        async with asyncio.TaskGroup() as tg:
+            tasks = [
+                tg.create_task(self._analyze_wallet_bounded(addr, period_days, balances.get(addr)))
+                for addr in addresses
+            ]
+        return [task.result() for task in tasks]
 
 analyzer = WalletAnalyzer()
 user_contexts = {}
@@ -569,95 +1399,142 @@ async def analyze_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         results = await analyzer.analyze_multiple_wallets(addresses)
-        await send_analysis_results(update, results, addresses, None)
-        await processing_msg.delete()
+        # Chunks must arrive in order, but removing the placeholder needn't wait for them
+        await asyncio.gather(
+            send_analysis_results(update, results, addresses, None),
+            processing_msg.delete(),
+        )
         
     except Exception as e:
-        logger.error(f"Error in analyze_command: {e}")
-        await update.message.reply_text(f"❌ Error: {str(e)}")
+        logger.error(f"Error in analyze_command: {error_text(e)}")
+        await update.message.reply_text(f"❌ Error: {error_text(e)}")
         try:
             await processing_msg.delete()
         except:
             pass
 
+def telegram_len(text: str) -> int:
+    """Message length as Telegram counts it, in UTF-16 code units (most emoji count as 2)"""
+    return len(text.encode('utf-16-le')) // 2
+
+def hard_split(line: str, limit: int) -> List[str]:
+    """Cut a single over-long line into pieces of at most limit UTF-16 units, never inside a character"""
+    pieces = []
+    start = size = 0
+    for i, char in enumerate(line):
+        char_size = 2 if ord(char) > 0xFFFF else 1
+        if size + char_size > limit:
+            pieces.append(line[start:i])
+            start, size = i, 0
+        size += char_size
+    pieces.append(line[start:])
+    return pieces
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Split text into chunks within Telegram's length limit.
+    
+    Breaks only between lines, so Markdown entities (all line-local in our
+    messages) are never cut in half and rejected by Telegram's parser. A line
+    too long for a message on its own (say, a long error text) is cut mid-line
+    as a last resort.
+    """
+    lines = []
+    for line in text.splitlines(keepends=True):
+        lines.extend(hard_split(line, limit) if telegram_len(line) > limit else (line,))
+    
+    chunks = []
+    current = []
+    size = 0
+    for line in lines:
+        line_size = telegram_len(line)
+        if current and size + line_size > limit:
+            chunks.append(''.join(current))
+            current = []
+            size = 0
+        current.append(line)
+        size += line_size
+    if current:
+        chunks.append(''.join(current))
+    return chunks
+
 async def send_analysis_results(update: Update, results: List[Dict], addresses: List[str], period_days: Optional[int]):
     period_label = f"{period_days}D" if period_days else "All Time"
-    response = f"📊 *Wallet Analysis - {period_label}*\n\n"
+    parts = [f"📊 *Wallet Analysis - {period_label}*\n\n"]
+    add = parts.append
+    now_ts = int(time.time())
     
     for i, result in enumerate(results, 1):
         if 'error' in result:
-            response += f"❌ *Wallet {i}*\n`{addresses[i-1][:12]}...`\nError: {result['error']}\n\n"
+            add(f"❌ *Wallet {i}*\n`{addresses[i-1][:12]}...`\nError: {result['error']}\n\n")
             continue
         
-        response += f"{'='*35}\n"
-        response += f"✅ *Wallet {i}* - {result['chain']}\n"
-        response += f"📍 `{result['address'][:8]}...{result['address'][-6:]}`\n\n"
+        add(WALLET_SEPARATOR)
+        add(f"✅ *Wallet {i}* - {result['chain']}\n")
+        add(f"📍 `{result['short_address']}`\n\n")
         
-        if result.get('last_active'):
-            time_ago = datetime.now() - result['last_active']
-            response += f"🕐 Last Active: {format_time_ago(time_ago)}\n"
+        if result.get('last_active_ts'):
+            add(f"🕐 Last Active: {format_time_ago(now_ts - result['last_active_ts'])}\n")
         
-        if result.get('last_trade'):
-            trade_ago = datetime.now() - result['last_trade']
-            response += f"💱 Last Trade: {format_time_ago(trade_ago)}\n"
+        if result.get('last_trade_ts'):
+            add(f"💱 Last Trade: {format_time_ago(now_ts - result['last_trade_ts'])}\n")
         
-        response += f"\n💰 *Current Holdings:*\n"
+        add(f"\n💰 *Current Holdings:*\n")
         currency = 'ETH' if result['chain'] == 'Ethereum' else 'SOL'
-        response += f"   {result['current_balance']:.4f} {currency}\n"
+        add(f"   {result['current_balance']:.4f} {currency}\n")
         
         if 'current_balance_usd' in result:
-            response += f"   ≈ ${result['current_balance_usd']:.2f} USD\n"
+            add(f"   ≈ ${result['current_balance_usd']:.2f} USD\n")
         
         if result['chain'] == 'Ethereum':
-            response += f"\n📈 *P&L Analysis:*\n"
+            add(f"\n📈 *P&L Analysis:*\n")
             
             eth_pnl = result.get('eth_pnl', 0)
             eth_pnl_usd = result.get('eth_pnl_usd', 0)
             pnl_emoji = "📈" if eth_pnl_usd > 0 else "📉" if eth_pnl_usd < 0 else "➖"
             
-            response += f"   {pnl_emoji} ETH: {eth_pnl:+.4f} ETH (${eth_pnl_usd:+.2f})\n"
+            add(f"   {pnl_emoji} ETH: {eth_pnl:+.4f} ETH (${eth_pnl_usd:+.2f})\n")
             
             token_pnl = result.get('token_pnl', {})
             if token_pnl.get('total_trades', 0) > 0:
-                response += f"   📝 Token Trades: {token_pnl['total_trades']}\n"
-                response += f"   🎯 Active Positions: {token_pnl['positions']}\n"
+                add(f"   📝 Token Trades: {token_pnl['total_trades']}\n")
+                add(f"   🎯 Active Positions: {token_pnl['positions']}\n")
                 
                 if token_pnl.get('most_profitable'):
                     mp = token_pnl['most_profitable']
-                    response += f"\n🏆 *Most Profitable:*\n"
-                    response += f"   Token: {mp['token']}\n"
-                    response += f"   P&L: {mp['pnl']:+.2f} tokens\n"
-                    response += f"   Hold Time: {mp['hold_days']} days\n"
+                    add(f"\n🏆 *Most Profitable:*\n")
+                    add(f"   Token: {mp['token']}\n")
+                    add(f"   P&L: {mp['pnl']:+.2f} tokens\n")
+                    add(f"   Hold Time: {mp['hold_days']} days\n")
         
         elif result['chain'] == 'Solana':
             if 'sol_pnl' in result:
-                response += f"\n📈 *P&L Analysis:*\n"
+                add(f"\n📈 *P&L Analysis:*\n")
                 sol_pnl = result.get('sol_pnl', 0)
                 sol_pnl_usd = result.get('sol_pnl_usd', 0)
                 pnl_emoji = "📈" if sol_pnl_usd > 0 else "📉" if sol_pnl_usd < 0 else "➖"
                 
-                response += f"   {pnl_emoji} SOL: {sol_pnl:+.4f} SOL (${sol_pnl_usd:+.2f})\n"
+                add(f"   {pnl_emoji} SOL: {sol_pnl:+.4f} SOL (${sol_pnl_usd:+.2f})\n")
                 
                 if result.get('swap_count', 0) > 0:
-                    response += f"   🔄 Swaps/Trades: {result['swap_count']}\n"
-                    response += f"   🎯 Active Tokens: {result.get('active_tokens', 0)}\n"
+                    add(f"   🔄 Swaps/Trades: {result['swap_count']}\n")
+                    add(f"   🎯 Active Tokens: {result.get('active_tokens', 0)}\n")
                 
                 if result.get('most_profitable'):
                     mp = result['most_profitable']
-                    response += f"\n🏆 *Most Profitable:*\n"
-                    response += f"   Token: {mp['token']}\n"
-                    response += f"   P&L: {mp['pnl']:+.4f} tokens\n"
-                    response += f"   Hold Time: {mp['hold_days']} days\n"
+                    add(f"\n🏆 *Most Profitable:*\n")
+                    add(f"   Token: {mp['token']}\n")
+                    add(f"   P&L: {mp['pnl']:+.4f} tokens\n")
+                    add(f"   Hold Time: {mp['hold_days']} days\n")
             else:
-                response += f"\n⚠️ *Note:* Detailed P&L requires Helius API key\n"
+                add(f"\n⚠️ *Note:* Detailed P&L requires Helius API key\n")
         
-        response += f"\n📊 *Activity ({period_label}):*\n"
-        response += f"   Total Txs: {result.get('total_transactions', 0)}\n"
+        add(f"\n📊 *Activity ({period_label}):*\n")
+        add(f"   Total Txs: {result.get('total_transactions', 0)}\n")
         
         if result['chain'] == 'Ethereum':
-            response += f"   Token Transfers: {result.get('total_token_transfers', 0)}\n"
+            add(f"   Token Transfers: {result.get('total_token_transfers', 0)}\n")
         
-        response += "\n"
+        add("\n")
     
     keyboard = [
         [
@@ -669,13 +1546,10 @@ async def send_analysis_results(update: Update, results: List[Dict], addresses:
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    if len(response) > 4096:
-        chunks = [response[i:i+4096] for i in range(0, len(response), 4096)]
-        for chunk in chunks[:-1]:
-            await update.effective_message.reply_text(chunk, parse_mode='Markdown')
-        await update.effective_message.reply_text(chunks[-1], parse_mode='Markdown', reply_markup=reply_markup)
-    else:
-        await update.effective_message.reply_text(response, parse_mode='Markdown', reply_markup=reply_markup)
+    chunks = split_message(''.join(parts))
+    for chunk in chunks[:-1]:
+        await update.effective_message.reply_text(chunk, parse_mode='Markdown')
+    await update.effective_message.reply_text(chunks[-1], parse_mode='Markdown', reply_markup=reply_markup)
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -699,29 +1573,32 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await send_analysis_results(update, results, addresses, period_days)
         
     except Exception as e:
-        logger.error(f"Error in button_callback: {e}")
-        await query.edit_message_text(f"❌ Error: {str(e)}")
+        logger.error(f"Error in button_callback: {error_text(e)}")
+        await query.edit_message_text(f"❌ Error: {error_text(e)}")
 
-def format_time_ago(delta: timedelta) -> str:
-    seconds = int(delta.total_seconds())
-    
+SECONDS_PER_MONTH = 30 * 86400  # months in "time ago" labels are 30 days
+
+# (upper bound in seconds, unit suffix, seconds per unit), checked in order
+TIME_AGO_BUCKETS = (
+    (60, 's', 1),
+    (3600, 'm', 60),
+    (86400, 'h', 3600),
+    (SECONDS_PER_MONTH, 'd', 86400),
+)
+
+def format_time_ago(seconds: int) -> str:
     if seconds < 0:
         return "just now"
-    elif seconds < 60:
-        return f"{seconds}s ago"
-    elif seconds < 3600:
-        return f"{seconds // 60}m ago"
-    elif seconds < 86400:
-        return f"{seconds // 3600}h ago"
-    elif seconds < 2592000:
-        return f"{seconds // 86400}d ago"
-    else:
-        return f"{seconds // 2592000}mo ago"
+    for bound, unit, size in TIME_AGO_BUCKETS:
+        if seconds < bound:
+            return f"{seconds // size}{unit} ago"
+    return f"{seconds // SECONDS_PER_MONTH}mo ago"
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.error(f"Update {update} caused error {context.error}")
+    logger.error(f"Update {update} caused error {error_text(context.error)}")
 
 async def post_init(application: Application):
+    await analyzer.warm_up()
     logger.info("🤖 Bot initialized successfully")
     logger.info(f"✓ Etherscan API configured")
     logger.info(f"{'✓' if HELIUS_API_KEY else '⚠'} Helius API {'configured (FULL P&L ENABLED)' if HELIUS_API_KEY else 'not configured (limited Solana P&L)'}")
@@ -732,11 +1609,22 @@ async def post_shutdown(application: Application):
     logger.info("Bot shutdown complete")
 
 def main():
+    # uvloop is optional (it has no Windows build); install it before PTB creates the event loop
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    
     application = (
         Application.builder()
         .token(TELEGRAM_BOT_TOKEN)
         .post_init(post_init)
         .post_shutdown(post_shutdown)
+        .connection_pool_size(TELEGRAM_POOL_SIZE)
+        .pool_timeout(TELEGRAM_POOL_TIMEOUT)
+        .get_updates_connection_pool_size(TELEGRAM_UPDATES_POOL_SIZE)
+        .get_updates_pool_timeout(TELEGRAM_POOL_TIMEOUT)
         .build()
     )
     
@@ -0,0 +1,87 @@
+import asyncio
+import faulthandler
+import os
+import tempfile
+import unittest
+
+os.environ.setdefault('WALLET_DB_PATH', os.path.join(tempfile.mkdtemp(), 'wallet_cache.db'))
+
+import bot
+
+
+def raw(covered_from, rows=0):
+    """Ethereum raw data reaching back to covered_from; smaller is deeper"""
+    return bot.EthereumRaw([], [bot.EthTokenTx(0, 0.0, '', '', '', '')] * rows, 0, covered_from)
+
+
+class CachedRawTest(unittest.IsolatedAsyncioTestCase):
+    """Concurrent callers of WalletAnalyzer._cached_raw that need different history depths"""
+
+    def setUp(self):
+        # A regression here is a busy loop that never yields, which no asyncio timeout can interrupt
+        faulthandler.dump_traceback_later(30, exit=True)
+        self.analyzer = bot.WalletAnalyzer()
+
+    def tearDown(self):
+        faulthandler.cancel_dump_traceback_later()
+        self.analyzer.history_store.close()
+
+    async def test_deep_caller_after_shallow_fetch_finishes(self):
+        finishing = asyncio.Event()
+        calls = []
+
+        async def fetch_shallow():
+            calls.append('shallow')
+            await asyncio.sleep(0)
+            # Wake the deep caller in the same loop pass the shallow fetch completes in
+            finishing.set()
+            return raw(100), True
+
+        async def fetch_deep():
+            calls.append('deep')
+            await asyncio.sleep(0)
+            return raw(0), True
+
+        async def deep_caller():
+            await finishing.wait()
+            return await self.analyzer._cached_raw('key', fetch_deep, usable=lambda data: data.covered_from <= 0)
+
+        shallow, deep = await asyncio.gather(
+            self.analyzer._cached_raw('key', fetch_shallow),
+            deep_caller(),
+        )
+        self.assertEqual((shallow, deep), (raw(100), raw(0)))
+        self.assertEqual(calls, ['shallow', 'deep'])
+        self.assertEqual(self.analyzer.raw_cache['key'], raw(0))
+        self.assertEqual(self.analyzer.inflight_raw, {})
+
+    async def test_shallow_and_deep_requests_overlap(self):
+        calls = []
+
+        async def fetch(covered_from):
+            calls.append(covered_from)
+            await asyncio.sleep(0.01)
+            return raw(covered_from), True
+
+        results = await asyncio.gather(
+            self.analyzer._cached_raw('key', lambda: fetch(100), usable=lambda data: data.covered_from <= 100),
+            self.analyzer._cached_raw('key', lambda: fetch(100), usable=lambda data: data.covered_from <= 100),
+            self.analyzer._cached_raw('key', lambda: fetch(0), usable=lambda data: data.covered_from <= 0),
+        )
+        self.assertEqual(results, [raw(100), raw(100), raw(0)])
+        self.assertEqual(calls, [100, 0])
+        self.assertEqual(self.analyzer.inflight_raw, {})
+
+    async def test_entry_larger_than_cache_is_served_uncached(self):
+        big = raw(0, rows=self.analyzer.raw_cache.maxsize + 1)
+
+        async def fetch():
+            return big, True
+
+        self.assertIs(await self.analyzer._cached_raw('key', fetch), big)
+        self.assertNotIn('key', self.analyzer.raw_cache)
+        self.assertEqual(self.analyzer.inflight_raw, {})
+
+
+if __name__ == '__main__':
+    unittest.main()